@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
+import hashlib
+import json
 import os
+import threading
+import weakref
+from collections import OrderedDict
 from pprint import pprint
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 import requests
 
+from mysodexo.circuit import CircuitOpenError, get_circuit_breaker
 from mysodexo.constants import (
     BASE_URL,
     DEFAULT_DEVICE_UID,
@@ -13,13 +19,25 @@ from mysodexo.constants import (
     GET_CARDS_ENDPOINT,
     GET_CLEAR_PIN_ENDPOINT,
     GET_DETAIL_CARD_ENDPOINT,
+    HTTP_NOT_MODIFIED,
+    HTTP_PRECONDITION_FAILED,
+    HTTP_SERVER_ERRORS,
     JSON_RESPONSE_OK_CODE,
     JSON_RESPONSE_OK_MSG,
     LOGIN_ENDPOINT,
     LOGIN_FROM_SESSION_ENDPOINT,
     REQUESTS_CERT,
     REQUESTS_HEADERS,
+    REQUESTS_TIMEOUT,
+    STALE_ENDPOINTS,
+    STALE_RESPONSES_MAX_ENTRIES,
 )
+from mysodexo.profiling import span
+
+# last successful json responses per session, keyed by endpoint and data,
+# see `session_post()`, entries go away with their session
+_stale_responses: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_stale_responses_lock = threading.Lock()
 
 
 def get_full_endpoint_url(endpoint: str, lang: str = DEFAULT_LANG) -> str:
@@ -35,19 +53,91 @@ def handle_code_msg(json_response: dict):
     assert msg == JSON_RESPONSE_OK_MSG, (code, msg)
 
 
-def session_post(
+def session_post_response(
+    session: requests.sessions.Session,
+    endpoint: str,
+    data: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None,
+) -> requests.Response:
+    """
+    Posts JSON `data` to `endpoint` using the `session`.
+    Returns the raw response, extra `headers` get merged to the default ones.
+    Raises `CircuitOpenError` without posting if the endpoint circuit is open.
+    """
+    url = get_full_endpoint_url(endpoint)
+    headers = dict(REQUESTS_HEADERS, **(headers or {}))
+    circuit_breaker = get_circuit_breaker(endpoint)
+    with circuit_breaker.call(), span(f"http {endpoint}"):
+        response = session.post(
+            url,
+            json=data,
+            cert=REQUESTS_CERT,
+            headers=headers,
+            timeout=REQUESTS_TIMEOUT,
+        )
+        if response.status_code in HTTP_SERVER_ERRORS:
+            response.raise_for_status()
+    return response
+
+
+def get_stale_key(endpoint: str, data: Dict[str, Any]) -> str:
+    data_json = json.dumps(data, sort_keys=True).encode()
+    return f"{endpoint}:{hashlib.sha256(data_json).hexdigest()}"
+
+
+def get_stale_response(
     session: requests.sessions.Session, endpoint: str, data: Dict[str, Any]
+) -> Optional[dict]:
+    """Returns the last successful response of `session`, if any."""
+    stale_key = get_stale_key(endpoint, data)
+    with _stale_responses_lock:
+        stale_responses = _stale_responses.get(session, OrderedDict())
+        return stale_responses.get(stale_key)
+
+
+def cache_stale_response(
+    session: requests.sessions.Session,
+    endpoint: str,
+    data: Dict[str, Any],
+    json_response: dict,
+) -> None:
+    """Keeps up to `STALE_RESPONSES_MAX_ENTRIES` responses per session."""
+    stale_key = get_stale_key(endpoint, data)
+    with _stale_responses_lock:
+        stale_responses = _stale_responses.setdefault(session, OrderedDict())
+        stale_responses[stale_key] = json_response
+        stale_responses.move_to_end(stale_key)
+        while len(stale_responses) > STALE_RESPONSES_MAX_ENTRIES:
+            stale_responses.popitem(last=False)
+
+
+def session_post(
+    session: requests.sessions.Session,
+    endpoint: str,
+    data: Dict[str, Any],
+    serve_stale: bool = False,
 ) -> dict:
     """
     Posts JSON `data` to `endpoint` using the `session`.
     Handles errors and returns a json response dict.
+    With `serve_stale` the last successful response is returned rather than
+    raising `CircuitOpenError` when the endpoint circuit is open.
+    Successful responses of `STALE_ENDPOINTS` are always kept for that.
     """
-    endpoint = get_full_endpoint_url(endpoint)
-    response = session.post(
-        endpoint, json=data, cert=REQUESTS_CERT, headers=REQUESTS_HEADERS
-    )
-    json_response = response.json()
+    try:
+        response = session_post_response(session, endpoint, data)
+    except CircuitOpenError:
+        stale_response = None
+        if serve_stale:
+            stale_response = get_stale_response(session, endpoint, data)
+        if stale_response is not None:
+            return stale_response
+        raise
+    with span(f"json {endpoint}"):
+        json_response = response.json()
     handle_code_msg(json_response)
+    if endpoint in STALE_ENDPOINTS:
+        cache_stale_response(session, endpoint, data, json_response)
     return json_response
 
 
@@ -75,30 +165,96 @@ def login_from_session(session: requests.sessions.Session) -> dict:
     return account_info
 
 
-def get_cards(session: requests.sessions.Session, dni: str) -> list:
+def get_cards(
+    session: requests.sessions.Session, dni: str, serve_stale: bool = False
+) -> list:
     """Returns cards list and details using the session provided."""
     endpoint = GET_CARDS_ENDPOINT
     data = {
         "dni": dni,
     }
-    json_response = session_post(session, endpoint, data)
+    json_response = session_post(session, endpoint, data, serve_stale)
     card_list = json_response["response"]["listCard"]
     return card_list
 
 
 def get_detail_card(
-    session: requests.sessions.Session, card_number: str
+    session: requests.sessions.Session,
+    card_number: str,
+    serve_stale: bool = False,
 ) -> dict:
     """Returns card details."""
     endpoint = GET_DETAIL_CARD_ENDPOINT
     data = {
         "cardNumber": card_number,
     }
-    json_response = session_post(session, endpoint, data)
+    json_response = session_post(session, endpoint, data, serve_stale)
     details = json_response["response"]["cardDetail"]
     return details
 
 
+def get_conditional_headers(cache_entry: dict) -> Dict[str, str]:
+    """
+    Returns the conditional request headers matching a cached response.
+    Only `If-None-Match` applies to POST requests, `If-Modified-Since` would
+    be ignored by the server.
+    """
+    headers = {}
+    if cache_entry.get("etag"):
+        headers["If-None-Match"] = cache_entry["etag"]
+    return headers
+
+
+def get_balance(
+    session: requests.sessions.Session,
+    card_number: str,
+    cache: Optional[Dict[str, dict]] = None,
+    serve_stale: bool = False,
+) -> float:
+    """
+    Returns card balance.
+    The `cache` dict is keyed by card number and gets updated in place, it's
+    used for conditional requests and to skip decoding unchanged details.
+    With `serve_stale` the cached balance is returned when the circuit is open.
+    """
+    endpoint = GET_DETAIL_CARD_ENDPOINT
+    cache = {} if cache is None else cache
+    cache_entry = cache.get(card_number, {})
+    data = {
+        "cardNumber": card_number,
+    }
+    headers = get_conditional_headers(cache_entry)
+    try:
+        response = session_post_response(session, endpoint, data, headers)
+    except CircuitOpenError:
+        if serve_stale and "balance" in cache_entry:
+            return cache_entry["balance"]
+        raise
+    # a matching `If-None-Match` on a POST gets a 412 from compliant servers
+    not_modified = response.status_code in (
+        HTTP_NOT_MODIFIED,
+        HTTP_PRECONDITION_FAILED,
+        HTTP_PRECONDITION_FAILED,
+    )
+    if not_modified and "balance" in cache_entry:
+        return cache_entry["balance"]
+    digest = hashlib.sha256(response.content).hexdigest()
+    if digest == cache_entry.get("digest"):
+        # validators may rotate while the payload stays the same
+        cache_entry["etag"] = response.headers.get("ETag")
+        return cache_entry["balance"]
+    with span(f"json {endpoint}"):
+        json_response = response.json()
+    handle_code_msg(json_response)
+    balance = json_response["response"]["cardDetail"]["cardBalance"]
+    cache[card_number] = {
+        "etag": response.headers.get("ETag"),
+        "digest": digest,
+        "balance": balance,
+    }
+    return balance
+
+
 def get_clear_pin(session: requests.sessions.Session, card_number: str) -> str:
     """Returns card pin."""
     endpoint = GET_CLEAR_PIN_ENDPOINT
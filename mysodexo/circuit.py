@@ -0,0 +1,247 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+)
+
+import requests
+
+from mysodexo.constants import API_ENDPOINTS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+DEFAULT_FAILURE_RATE_THRESHOLD = 0.5
+DEFAULT_MINIMUM_CALLS = 5
+DEFAULT_WINDOW_SIZE = 20
+DEFAULT_RESET_TIMEOUT = 30.0
+DEFAULT_HALF_OPEN_MAX_CALLS = 1
+DEFAULT_FAILURE_EXCEPTIONS: Tuple[Type[BaseException], ...] = (
+    requests.RequestException,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised when calling an endpoint whose circuit is open."""
+
+    def __init__(self, name: str):
+        super().__init__(f"circuit {name} is open")
+        self.name = name
+
+
+class CallToken(NamedTuple):
+    """Identifies the circuit state a call was let through in."""
+
+    generation: int
+    probe: bool
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of the last `window_size` calls and opens the circuit
+    when the failure rate reaches `failure_rate_threshold`.
+    After `reset_timeout` seconds up to `half_open_max_calls` probes are let
+    through, the first probe outcome closes or re-opens the circuit.
+    Outcomes of calls let through before the last state change are ignored.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = DEFAULT_FAILURE_RATE_THRESHOLD,
+        minimum_calls: int = DEFAULT_MINIMUM_CALLS,
+        window_size: int = DEFAULT_WINDOW_SIZE,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+        half_open_max_calls: int = DEFAULT_HALF_OPEN_MAX_CALLS,
+        failure_exceptions: Tuple[
+            Type[BaseException], ...
+        ] = DEFAULT_FAILURE_EXCEPTIONS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.failure_exceptions = failure_exceptions
+        self.clock = clock
+        # `True` for a success and `False` for a failure
+        self.outcomes: Deque[bool] = deque(maxlen=window_size)
+        self.opened_at: Optional[float] = None
+        self.half_open_calls = 0
+        # bumped on every state change
+        self.generation = 0
+        self._state = CLOSED
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        self.generation += 1
+
+    def _current_state(self) -> str:
+        if self._state == OPEN:
+            assert self.opened_at is not None
+            if self.clock() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+                self.half_open_calls = 0
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    @property
+    def failure_rate(self) -> float:
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def _open(self) -> None:
+        self._set_state(OPEN)
+        self.opened_at = self.clock()
+
+    def _close(self) -> None:
+        self._set_state(CLOSED)
+        self.opened_at = None
+        self.outcomes.clear()
+
+    def _is_current(self, token: Optional[CallToken]) -> bool:
+        """
+        Returns whether `token` was let through in the current state.
+        Outcomes recorded without token are taken as current.
+        """
+        return token is None or token.generation == self.generation
+
+    def before_call(self) -> CallToken:
+        """
+        Raises `CircuitOpenError` if the call should not go through.
+        Returns the token to record the call outcome with.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN:
+                raise CircuitOpenError(self.name)
+            if state == HALF_OPEN:
+                if self.half_open_calls >= self.half_open_max_calls:
+                    raise CircuitOpenError(self.name)
+                self.half_open_calls += 1
+            return CallToken(self.generation, state == HALF_OPEN)
+
+    def record_success(self, token: Optional[CallToken] = None) -> None:
+        with self._lock:
+            if not self._is_current(token):
+                return
+            if self._state == HALF_OPEN:
+                self._close()
+            else:
+                self.outcomes.append(True)
+
+    def record_failure(self, token: Optional[CallToken] = None) -> None:
+        with self._lock:
+            if not self._is_current(token):
+                return
+            if self._state == HALF_OPEN:
+                self._open()
+                return
+            self.outcomes.append(False)
+            if len(self.outcomes) < self.minimum_calls:
+                return
+            failures = self.outcomes.count(False)
+            if failures / len(self.outcomes) >= self.failure_rate_threshold:
+                self._open()
+
+    def release_probe(self, token: CallToken) -> None:
+        """Frees the half-open probe slot of a call without outcome."""
+        with self._lock:
+            if not token.probe or not self._is_current(token):
+                return
+            if self.half_open_calls > 0:
+                self.half_open_calls -= 1
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        """
+        Guards the wrapped block, `failure_exceptions` count as failures.
+        Other exceptions mean the upstream answered and count as successes.
+        Interruptions (e.g. `KeyboardInterrupt`) don't count either way.
+        """
+        token = self.before_call()
+        try:
+            yield
+        except self.failure_exceptions:
+            self.record_failure(token)
+            raise
+        except Exception:
+            self.record_success(token)
+            raise
+        except BaseException:
+            self.release_probe(token)
+            raise
+        else:
+            self.record_success(token)
+
+    def health(self) -> dict:
+        """Returns a snapshot of the circuit state."""
+        with self._lock:
+            calls = len(self.outcomes)
+            failures = self.outcomes.count(False)
+            return {
+                "state": self._current_state(),
+                "calls": calls,
+                "failures": failures,
+                "failure_rate": failures / calls if calls else 0.0,
+                "opened_at": self.opened_at,
+            }
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    """Returns the circuit breaker of `endpoint`, creating it if needed."""
+    with _circuit_breakers_lock:
+        if endpoint not in _circuit_breakers:
+            _circuit_breakers[endpoint] = CircuitBreaker(endpoint)
+        return _circuit_breakers[endpoint]
+
+
+def configure_circuit_breaker(endpoint: str, **kwargs) -> CircuitBreaker:
+    """Replaces the circuit breaker of `endpoint` with a configured one."""
+    circuit_breaker = CircuitBreaker(endpoint, **kwargs)
+    with _circuit_breakers_lock:
+        _circuit_breakers[endpoint] = circuit_breaker
+    return circuit_breaker
+
+
+def reset_circuit_breakers() -> None:
+    """Forgets all the circuit breakers and their state."""
+    with _circuit_breakers_lock:
+        _circuit_breakers.clear()
+
+
+def get_health() -> Dict[str, dict]:
+    """
+    Returns the health snapshot per endpoint.
+    All the `API_ENDPOINTS` are reported, even before any call.
+    """
+    with _circuit_breakers_lock:
+        for endpoint in API_ENDPOINTS:
+            if endpoint not in _circuit_breakers:
+                _circuit_breakers[endpoint] = CircuitBreaker(endpoint)
+        circuit_breakers = dict(_circuit_breakers)
+    return {
+        endpoint: circuit_breaker.health()
+        for endpoint, circuit_breaker in circuit_breakers.items()
+    }
@@ -2,14 +2,20 @@
 import argparse
 import os
 import pickle
+import sys
 from getpass import getpass
-from typing import Tuple
+from typing import Dict, Tuple
 
 import requests
 from appdirs import user_cache_dir
 
 from mysodexo import api
-from mysodexo.constants import APPLICATION_NAME, SESSION_CACHE_FILENAME
+from mysodexo.constants import (
+    APPLICATION_NAME,
+    BALANCE_CACHE_FILENAME,
+    SESSION_CACHE_FILENAME,
+)
+from mysodexo.profiling import OUTPUT_FORMATS, PSTATS_FORMAT, profile, span
 
 
 def prompt_login() -> Tuple[str, str]:
@@ -30,7 +36,7 @@ def get_cached_session_info() -> Tuple[
 ]:
     """Returns session and DNI from cache."""
     session_cache_path = get_session_cache_path()
-    with open(session_cache_path, "rb") as f:
+    with span("session cache load"), open(session_cache_path, "rb") as f:
         cached_session_info = pickle.load(f)
     cookies = cached_session_info["cookies"]
     dni = cached_session_info["dni"]
@@ -51,6 +57,30 @@ def cache_session_info(
         pickle.dump(cached_session_info, f)
 
 
+def get_balance_cache_path() -> str:
+    return os.path.join(
+        user_cache_dir(appname=APPLICATION_NAME), BALANCE_CACHE_FILENAME
+    )
+
+
+def get_cached_balances() -> Dict[str, dict]:
+    """Returns the per card balance cache, empty if not cached yet."""
+    balance_cache_path = get_balance_cache_path()
+    try:
+        with span("balance cache load"), open(balance_cache_path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def cache_balances(balances: Dict[str, dict]) -> None:
+    """Stores the per card balance cache."""
+    balance_cache_path = get_balance_cache_path()
+    os.makedirs(os.path.dirname(balance_cache_path), exist_ok=True)
+    with open(balance_cache_path, "wb") as f:
+        pickle.dump(balances, f)
+
+
 def login() -> Tuple[requests.sessions.Session, str]:
     """Logins and returns session info."""
     email, password = prompt_login()
@@ -81,21 +111,30 @@ def print_balance(cards):
     """Prints per card balance."""
     for card in cards:
         pan = card["pan"]
-        details = card["_details"]
-        balance = details["cardBalance"]
+        balance = card["_balance"]
         print(f"{pan}: {balance}")
 
 
 def process_balance():
     session, dni = get_session_or_login()
+    balances = get_cached_balances()
     cards = api.get_cards(session, dni)
     for card in cards:
         card_number = card["cardNumber"]
-        details = api.get_detail_card(session, card_number)
-        card["_details"] = details
+        card["_balance"] = api.get_balance(session, card_number, balances)
+    cache_balances(balances)
     print_balance(cards)
 
 
+def process_args(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.login:
+        process_login()
+    elif args.balance:
+        process_balance()
+    else:
+        parser.print_help()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="MySodexo Command Line Interface"
@@ -110,13 +149,31 @@ def main():
         action="store_true",
         help="Returns account balance per card",
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Prints a per phase timing summary to stderr.",
+    )
+    parser.add_argument(
+        "--profile-output",
+        metavar="FILE",
+        help="Writes the profile to FILE, implies --profile.",
+    )
+    parser.add_argument(
+        "--profile-format",
+        choices=OUTPUT_FORMATS,
+        help=f"Format of --profile-output (default: {PSTATS_FORMAT}).",
+    )
     args = parser.parse_args()
-    if args.login:
-        process_login()
-    elif args.balance:
-        process_balance()
+    if args.profile_format and not args.profile_output:
+        parser.error("--profile-format requires --profile-output")
+    if args.profile or args.profile_output:
+        profile_format = args.profile_format or PSTATS_FORMAT
+        with profile(args.profile_output, profile_format) as profiler:
+            process_args(parser, args)
+        print(profiler.summary(), file=sys.stderr)
     else:
-        parser.print_help()
+        process_args(parser, args)
 
 
 if __name__ == "__main__":
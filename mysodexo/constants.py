@@ -11,12 +11,28 @@ JSON_RESPONSE_OK_CODE = 100
 JSON_RESPONSE_OK_MSG = "OK"
 REQUESTS_CERT = (CERT_PATH, KEY_PATH)
 REQUESTS_HEADERS = {"Accept": "application/json"}
+REQUESTS_TIMEOUT = 30
+HTTP_NOT_MODIFIED = 304
+HTTP_PRECONDITION_FAILED = 412
+HTTP_SERVER_ERRORS = range(500, 600)
+STALE_RESPONSES_MAX_ENTRIES = 32
 DEFAULT_DEVICE_UID = "device_uid"
 DEFAULT_OS = 0
 APPLICATION_NAME = "mysodexo"
 SESSION_CACHE_FILENAME = "session.cache"
+BALANCE_CACHE_FILENAME = "balance.cache"
 LOGIN_ENDPOINT = "v3/connect/login"
 LOGIN_FROM_SESSION_ENDPOINT = "v3/connect/loginFromSession"
 GET_CARDS_ENDPOINT = "v3/card/getCards"
 GET_DETAIL_CARD_ENDPOINT = "v2/card/getDetailCard"
 GET_CLEAR_PIN_ENDPOINT = "v1/card/getClearPin"
+API_ENDPOINTS = (
+    LOGIN_ENDPOINT,
+    LOGIN_FROM_SESSION_ENDPOINT,
+    GET_CARDS_ENDPOINT,
+    GET_DETAIL_CARD_ENDPOINT,
+    GET_CLEAR_PIN_ENDPOINT,
+)
+# endpoints whose last successful responses can be served while their
+# circuit is open
+STALE_ENDPOINTS = (GET_CARDS_ENDPOINT, GET_DETAIL_CARD_ENDPOINT)
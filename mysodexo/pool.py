@@ -0,0 +1,300 @@
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from mysodexo import api
+from mysodexo.constants import BASE_URL
+
+DEFAULT_MAX_SESSIONS = 4
+DEFAULT_MAX_CONNECTIONS = 1
+
+CookiesSnapshot = Dict[Tuple[str, str, str], Optional[str]]
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no session got released within the acquire timeout."""
+
+
+class InvalidCredentialsError(Exception):
+    """Raised when the password doesn't match the pooled account one."""
+
+
+def get_cookies_snapshot(
+    cookies: requests.cookies.RequestsCookieJar,
+) -> CookiesSnapshot:
+    """Returns the cookie values keyed by name, domain and path."""
+    return {
+        (cookie.name, cookie.domain, cookie.path): cookie.value
+        for cookie in cookies
+    }
+
+
+class AccountSessionPool:
+    """
+    Hands out authenticated sessions of a single account.
+    A session is only used by one thread at a time, the account logs in once
+    and the other sessions get a copy of its cookies.
+    Cookies a session changed since its last sync are merged back to the
+    account cookies on release and synced to the other sessions on their next
+    acquire, so a session holding outdated cookies can't revert a refresh.
+    """
+
+    def __init__(
+        self,
+        email: str,
+        password: str,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.email = email
+        self.password = password
+        self.max_sessions = max_sessions
+        self.max_connections = max_connections
+        self.clock = clock
+        self.account_info: Optional[dict] = None
+        self.cookies: Optional[requests.cookies.RequestsCookieJar] = None
+        # bumped on every account cookies update
+        self.cookies_version = 0
+        self.session_cookies_versions: Dict[int, int] = {}
+        # session cookies as of their last sync with the account cookies
+        self.session_cookies_snapshots: Dict[int, CookiesSnapshot] = {}
+        self.idle: List[requests.sessions.Session] = []
+        self.size = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.acquisitions = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._condition = threading.Condition()
+        # guards the login and the account cookies
+        self._cookies_lock = threading.RLock()
+
+    def check_password(self, password: str) -> bool:
+        """
+        Returns whether `password` is the one the account logged in with.
+        Until the account logged in, the password simply gets replaced.
+        """
+        with self._cookies_lock:
+            if self.cookies is None:
+                self.password = password
+                return True
+            return hmac.compare_digest(
+                password.encode(), self.password.encode()
+            )
+
+    def mount_adapter(self, session: requests.sessions.Session) -> None:
+        """Caps the connections the `session` opens to the API."""
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.max_connections,
+            pool_block=True,
+        )
+        session.mount(BASE_URL, adapter)
+
+    def create_session(self) -> requests.sessions.Session:
+        """Returns a new session, logs in if the account never did."""
+        with self._cookies_lock:
+            if self.cookies is None:
+                session, account_info = api.login(self.email, self.password)
+                self.account_info = account_info
+                self.cookies = session.cookies.copy()
+            else:
+                session = requests.session()
+                session.cookies.update(self.cookies)
+            self.session_cookies_versions[id(session)] = self.cookies_version
+            self.session_cookies_snapshots[id(session)] = get_cookies_snapshot(
+                session.cookies
+            )
+        self.mount_adapter(session)
+        return session
+
+    def sync_cookies(self, session: requests.sessions.Session) -> None:
+        """Updates `session` with the account cookies if they changed."""
+        with self._cookies_lock:
+            version = self.session_cookies_versions.get(id(session))
+            if version == self.cookies_version:
+                return
+            assert self.cookies is not None
+            session.cookies.update(self.cookies)
+            self.session_cookies_versions[id(session)] = self.cookies_version
+            self.session_cookies_snapshots[id(session)] = get_cookies_snapshot(
+                session.cookies
+            )
+
+    def merge_cookies(self, session: requests.sessions.Session) -> None:
+        """
+        Updates the account cookies with the ones `session` received since
+        its last sync, cookies it merely still holds are left untouched.
+        """
+        with self._cookies_lock:
+            assert self.cookies is not None
+            snapshot = self.session_cookies_snapshots.get(id(session), {})
+            changed_cookies = [
+                cookie
+                for cookie in session.cookies
+                if snapshot.get((cookie.name, cookie.domain, cookie.path))
+                != cookie.value
+            ]
+            if not changed_cookies:
+                return
+            up_to_date = (
+                self.session_cookies_versions.get(id(session))
+                == self.cookies_version
+            )
+            for cookie in changed_cookies:
+                self.cookies.set_cookie(cookie)
+            self.cookies_version += 1
+            self.session_cookies_snapshots[id(session)] = get_cookies_snapshot(
+                session.cookies
+            )
+            # an outdated session still misses other updates, it gets synced
+            # on its next acquire
+            if up_to_date:
+                self.session_cookies_versions[id(session)] = (
+                    self.cookies_version
+                )
+
+    def refresh(self, session: requests.sessions.Session) -> dict:
+        """
+        Logins from the acquired `session` and shares the refreshed cookies.
+        Concurrent refreshes are serialized.
+        """
+        with self._cookies_lock:
+            self.sync_cookies(session)
+            account_info = api.login_from_session(session)
+            self.account_info = account_info
+            self.merge_cookies(session)
+        return account_info
+
+    def acquire(
+        self, timeout: Optional[float] = None
+    ) -> requests.sessions.Session:
+        """
+        Returns an idle session, creates one if under `max_sessions` or waits
+        up to `timeout` seconds for one to be released.
+        """
+        started_at = self.clock()
+        session = None
+        with self._condition:
+            while not self.idle and self.size >= self.max_sessions:
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (self.clock() - started_at)
+                    if remaining <= 0:
+                        raise PoolTimeoutError(self.email)
+                self.waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            if self.idle:
+                session = self.idle.pop()
+            else:
+                self.size += 1
+            self.in_use += 1
+            wait = self.clock() - started_at
+            self.acquisitions += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        try:
+            if session is None:
+                session = self.create_session()
+            else:
+                self.sync_cookies(session)
+        except Exception:
+            with self._condition:
+                if session is None:
+                    self.size -= 1
+                else:
+                    self.idle.append(session)
+                self.in_use -= 1
+                self._condition.notify()
+            raise
+        return session
+
+    def release(self, session: requests.sessions.Session) -> None:
+        """Gives back an acquired session and wakes up a waiting thread."""
+        self.merge_cookies(session)
+        with self._condition:
+            self.idle.append(session)
+            self.in_use -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def session(
+        self, timeout: Optional[float] = None
+    ) -> Iterator[requests.sessions.Session]:
+        session = self.acquire(timeout)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def stats(self) -> dict:
+        """Returns utilization and wait time statistics."""
+        with self._condition:
+            return {
+                "max_sessions": self.max_sessions,
+                "size": self.size,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "idle": len(self.idle),
+                "utilization": self.in_use / self.max_sessions,
+                "acquisitions": self.acquisitions,
+                "total_wait": self.total_wait,
+                "max_wait": self.max_wait,
+                "average_wait": (
+                    self.total_wait / self.acquisitions
+                    if self.acquisitions
+                    else 0.0
+                ),
+            }
+
+
+class SessionPool:
+    """Thread-safe pool of authenticated sessions per account."""
+
+    def __init__(
+        self,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    ):
+        self.max_sessions = max_sessions
+        self.max_connections = max_connections
+        self.accounts: Dict[str, AccountSessionPool] = {}
+        self._lock = threading.Lock()
+
+    def get_account(self, email: str, password: str) -> AccountSessionPool:
+        """
+        Returns the `email` account pool, creating it if needed.
+        Raises `InvalidCredentialsError` if `password` doesn't match.
+        """
+        with self._lock:
+            if email not in self.accounts:
+                self.accounts[email] = AccountSessionPool(
+                    email, password, self.max_sessions, self.max_connections
+                )
+            account = self.accounts[email]
+        if not account.check_password(password):
+            raise InvalidCredentialsError(email)
+        return account
+
+    @contextmanager
+    def session(
+        self, email: str, password: str, timeout: Optional[float] = None
+    ) -> Iterator[requests.sessions.Session]:
+        """Lends an authenticated session of the `email` account."""
+        with self.get_account(email, password).session(timeout) as session:
+            yield session
+
+    def stats(self) -> Dict[str, dict]:
+        """Returns the statistics per account."""
+        with self._lock:
+            accounts = dict(self.accounts)
+        return {email: account.stats() for email, account in accounts.items()}
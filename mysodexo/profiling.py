@@ -0,0 +1,191 @@
+import cProfile
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from urllib3.connection import HTTPSConnection
+
+PSTATS_FORMAT = "pstats"
+SPEEDSCOPE_FORMAT = "speedscope"
+OUTPUT_FORMATS = (PSTATS_FORMAT, SPEEDSCOPE_FORMAT)
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+CONNECT_SPAN = "tls connect"
+
+_active_profiler: Optional["Profiler"] = None
+_active_profiler_lock = threading.Lock()
+
+
+class Profiler:
+    """Records named spans and optionally a cProfile of the same run."""
+
+    def __init__(self, use_cprofile: bool = False):
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        # per thread ident list of ("O"pen/"C"lose, span name, timestamp)
+        # events, spans only nest within the thread that opened them
+        self.events: Dict[int, List[Tuple[str, str, float]]] = {}
+        self.cprofile = cProfile.Profile() if use_cprofile else None
+        self._lock = threading.Lock()
+
+    def _thread_events(self) -> List[Tuple[str, str, float]]:
+        thread_ident = threading.get_ident()
+        with self._lock:
+            return self.events.setdefault(thread_ident, [])
+
+    def open_span(self, name: str) -> None:
+        self._thread_events().append(("O", name, time.perf_counter()))
+
+    def close_span(self, name: str) -> None:
+        self._thread_events().append(("C", name, time.perf_counter()))
+
+    def totals(self) -> Dict[str, Tuple[int, float]]:
+        """Returns `(calls, cumulative seconds)` per span name."""
+        totals: Dict[str, Tuple[int, float]] = {}
+        with self._lock:
+            threads_events = [list(events) for events in self.events.values()]
+        for events in threads_events:
+            stack: List[Tuple[str, float]] = []
+            for kind, name, at in events:
+                if kind == "O":
+                    stack.append((name, at))
+                    continue
+                _, opened_at = stack.pop()
+                calls, elapsed = totals.get(name, (0, 0.0))
+                totals[name] = (calls + 1, elapsed + at - opened_at)
+        return totals
+
+    def summary(self) -> str:
+        """Returns a human readable timing summary of the spans."""
+        end = self.end if self.end is not None else time.perf_counter()
+        lines = [f"{'span':<40} {'calls':>6} {'total (ms)':>12}"]
+        for name, (calls, elapsed) in self.totals().items():
+            lines.append(f"{name:<40} {calls:>6} {elapsed * 1000:>12.2f}")
+        lines.append(
+            f"{'total':<40} {'':>6} {(end - self.start) * 1000:>12.2f}"
+        )
+        return "\n".join(lines)
+
+    def to_speedscope(self) -> dict:
+        """Returns the spans as speedscope evented profiles, one per thread."""
+        end = self.end if self.end is not None else time.perf_counter()
+        frames: List[Dict[str, str]] = []
+        frame_indexes: Dict[str, int] = {}
+        profiles = []
+        with self._lock:
+            threads_events = {
+                thread_ident: list(events)
+                for thread_ident, events in self.events.items()
+            }
+        for thread_ident, thread_events in threads_events.items():
+            events = []
+            for kind, name, at in thread_events:
+                if name not in frame_indexes:
+                    frame_indexes[name] = len(frames)
+                    frames.append({"name": name})
+                events.append(
+                    {
+                        "type": kind,
+                        "frame": frame_indexes[name],
+                        "at": at - self.start,
+                    }
+                )
+            profiles.append(
+                {
+                    "type": "evented",
+                    "name": f"mysodexo thread {thread_ident}",
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": end - self.start,
+                    "events": events,
+                }
+            )
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def dump(self, path: str, output_format: str = PSTATS_FORMAT) -> None:
+        """Writes the profile to `path` in the given `output_format`."""
+        assert output_format in OUTPUT_FORMATS, output_format
+        if output_format == SPEEDSCOPE_FORMAT:
+            with open(path, "w") as f:
+                json.dump(self.to_speedscope(), f)
+        else:
+            assert self.cprofile is not None, "cProfile was not enabled"
+            self.cprofile.dump_stats(path)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Times the wrapped block as `name`, no-op unless profiling."""
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+        return
+    profiler.open_span(name)
+    try:
+        yield
+    finally:
+        profiler.close_span(name)
+
+
+@contextmanager
+def trace_connections() -> Iterator[None]:
+    """
+    Times new HTTPS connections (TCP connect and TLS handshake) as their own
+    span, nested in the request span that triggered them.
+    """
+    connect = HTTPSConnection.connect
+
+    def traced_connect(self, *args, **kwargs):
+        with span(CONNECT_SPAN):
+            return connect(self, *args, **kwargs)
+
+    HTTPSConnection.connect = traced_connect  # type: ignore
+    try:
+        yield
+    finally:
+        HTTPSConnection.connect = connect  # type: ignore
+
+
+@contextmanager
+def profile(
+    output: Optional[str] = None,
+    output_format: str = PSTATS_FORMAT,
+    use_cprofile: Optional[bool] = None,
+) -> Iterator[Profiler]:
+    """
+    Profiles the library calls made within the block.
+    Spans are collected for the instrumented hot paths and the profile is
+    optionally written to `output` as pstats or speedscope.
+    Connection setup is timed apart from the requests, the remaining request
+    time is the upload, server wait and download.
+    Profiling is process-wide: spans of every thread get recorded and urllib3
+    `HTTPSConnection.connect` is patched for all its users while active, only
+    one profile can be active at once and `RuntimeError` is raised otherwise.
+    The cProfile part only covers the calling thread.
+    """
+    global _active_profiler
+    if use_cprofile is None:
+        use_cprofile = output is not None and output_format == PSTATS_FORMAT
+    profiler = Profiler(use_cprofile=use_cprofile)
+    with _active_profiler_lock:
+        if _active_profiler is not None:
+            raise RuntimeError("profiling is already active")
+        _active_profiler = profiler
+    if profiler.cprofile is not None:
+        profiler.cprofile.enable()
+    try:
+        with trace_connections():
+            yield profiler
+    finally:
+        if profiler.cprofile is not None:
+            profiler.cprofile.disable()
+        profiler.end = time.perf_counter()
+        with _active_profiler_lock:
+            _active_profiler = None
+        if output is not None:
+            profiler.dump(output, output_format)
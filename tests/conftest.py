@@ -0,0 +1,12 @@
+import pytest
+
+from mysodexo import api, circuit
+
+
+@pytest.fixture
+def reset_circuit_breakers():
+    circuit.reset_circuit_breakers()
+    api._stale_responses.clear()
+    yield
+    circuit.reset_circuit_breakers()
+    api._stale_responses.clear()
@@ -1,9 +1,11 @@
+import hashlib
+import json
 from unittest import mock
 
 import pytest
 import requests
 
-from mysodexo import api
+from mysodexo import api, circuit, profiling
 from mysodexo.constants import JSON_RESPONSE_OK_CODE, JSON_RESPONSE_OK_MSG
 
 
@@ -11,6 +13,13 @@ def patch_session_post():
     return mock.patch("requests.sessions.Session.post", autospec=True)
 
 
+def open_circuit(endpoint):
+    circuit_breaker = circuit.get_circuit_breaker(endpoint)
+    for _ in range(circuit_breaker.minimum_calls):
+        circuit_breaker.record_failure()
+    assert circuit_breaker.state == circuit.OPEN
+
+
 def test_get_full_endpoint_url():
     assert (
         api.get_full_endpoint_url(endpoint="endpoint1")
@@ -62,12 +71,121 @@ def test_session_post():
         api.session_post(session, endpoint, data)
     assert m_post.call_args_list == [
         mock.call(
-            session, expected_endpoint, cert=cert, headers=headers, json=data
+            session,
+            expected_endpoint,
+            cert=cert,
+            headers=headers,
+            json=data,
+            timeout=30,
         )
     ]
     m_handle_code_msg.call_args_list
 
 
+def test_session_post_profile():
+    """Request and decoding phases are recorded as spans when profiling."""
+    session = requests.session()
+    with patch_session_post(), mock.patch(
+        "mysodexo.api.handle_code_msg"
+    ), profiling.profile() as profiler:
+        api.session_post(session, "endpoint", {})
+    assert list(profiler.totals()) == ["http endpoint", "json endpoint"]
+
+
+def test_session_post_server_error(reset_circuit_breakers):
+    """Server errors are raised and recorded by the circuit breaker."""
+    session = mock.Mock(spec=requests.sessions.Session)
+    response = requests.Response()
+    response.status_code = 503
+    session.post.return_value = response
+    with pytest.raises(requests.HTTPError):
+        api.session_post(session, "endpoint", {})
+    assert circuit.get_health()["endpoint"]["failures"] == 1
+
+
+def test_session_post_circuit_open(reset_circuit_breakers):
+    """Fails fast without posting when the circuit is open."""
+    session = mock.Mock(spec=requests.sessions.Session)
+    open_circuit("endpoint")
+    with pytest.raises(circuit.CircuitOpenError):
+        api.session_post(session, "endpoint", {})
+    assert session.post.call_count == 0
+
+
+def test_session_post_serve_stale(reset_circuit_breakers):
+    """The last successful response is served when the circuit is open."""
+    endpoint = "v3/card/getCards"
+    session = mock.Mock(spec=requests.sessions.Session)
+    json_response = {
+        "code": JSON_RESPONSE_OK_CODE,
+        "msg": JSON_RESPONSE_OK_MSG,
+        "response": mock.sentinel,
+    }
+    session.post.return_value.json.return_value = json_response
+    data = {"foo": "bar"}
+    # successful calls are kept even without opting in
+    assert api.session_post(session, endpoint, data) == json_response
+    open_circuit(endpoint)
+    assert api.session_post(session, endpoint, data, True) == json_response
+    assert session.post.call_count == 1
+    # stale data is per request data and needs to be opted in per call
+    with pytest.raises(circuit.CircuitOpenError):
+        api.session_post(session, endpoint, {"foo": "baz"}, True)
+    with pytest.raises(circuit.CircuitOpenError):
+        api.session_post(session, endpoint, data)
+
+
+def test_session_post_serve_stale_endpoints(reset_circuit_breakers):
+    """Only `STALE_ENDPOINTS` responses are kept, e.g. not clear PINs."""
+    endpoint = "v1/card/getClearPin"
+    session = mock.Mock(spec=requests.sessions.Session)
+    session.post.return_value.json.return_value = {
+        "code": JSON_RESPONSE_OK_CODE,
+        "msg": JSON_RESPONSE_OK_MSG,
+    }
+    api.session_post(session, endpoint, {}, True)
+    assert session not in api._stale_responses
+    open_circuit(endpoint)
+    with pytest.raises(circuit.CircuitOpenError):
+        api.session_post(session, endpoint, {}, True)
+
+
+def test_session_post_serve_stale_per_session(reset_circuit_breakers):
+    """Stale responses of a session are never served to another one."""
+    session1 = mock.Mock(spec=requests.sessions.Session)
+    session2 = mock.Mock(spec=requests.sessions.Session)
+    session1.post.return_value.json.return_value = {
+        "code": JSON_RESPONSE_OK_CODE,
+        "msg": JSON_RESPONSE_OK_MSG,
+        "response": {"listCard": mock.sentinel},
+    }
+    assert api.get_cards(session1, "dni", True) == mock.sentinel
+    open_circuit("v3/card/getCards")
+    assert api.get_cards(session1, "dni", True) == mock.sentinel
+    with pytest.raises(circuit.CircuitOpenError):
+        api.get_cards(session2, "dni", True)
+    assert session2.post.call_count == 0
+
+
+def test_session_post_serve_stale_max_entries(reset_circuit_breakers):
+    """Only the most recent responses are kept per session."""
+    session = mock.Mock(spec=requests.sessions.Session)
+    session.post.return_value.json.return_value = {
+        "code": JSON_RESPONSE_OK_CODE,
+        "msg": JSON_RESPONSE_OK_MSG,
+    }
+    endpoint = "v2/card/getDetailCard"
+    with mock.patch("mysodexo.api.STALE_RESPONSES_MAX_ENTRIES", 2):
+        for i in range(3):
+            api.session_post(session, endpoint, {"i": i})
+    open_circuit(endpoint)
+    with pytest.raises(circuit.CircuitOpenError):
+        api.session_post(session, endpoint, {"i": 0}, True)
+    api.session_post(session, endpoint, {"i": 1}, True)
+    api.session_post(session, endpoint, {"i": 2}, True)
+    assert len(api._stale_responses[session]) == 2
+
+
 def test_login():
     email = "foo@bar.com"
     password = "password"
@@ -98,7 +216,7 @@ def test_login_from_session():
 
 
 def test_get_cards():
-    dni = mock.ANY
+    dni = "dni"
     session = mock.Mock(spec=requests.sessions.Session)
     s_card_list = mock.sentinel
     session.post.return_value.json.return_value = {
@@ -111,7 +229,7 @@ def test_get_cards():
 
 
 def test_get_detail_card():
-    card_number = mock.ANY
+    card_number = "card_number"
     session = mock.Mock(spec=requests.sessions.Session)
     s_details = mock.sentinel
     session.post.return_value.json.return_value = {
@@ -123,6 +241,107 @@ def test_get_detail_card():
     assert details == s_details
 
 
+def make_detail_card_response(balance, status_code=200, headers=None):
+    json_response = {
+        "code": JSON_RESPONSE_OK_CODE,
+        "msg": JSON_RESPONSE_OK_MSG,
+        "response": {"cardDetail": {"cardBalance": balance}},
+    }
+    response = mock.Mock(
+        spec=requests.Response,
+        status_code=status_code,
+        headers=headers or {},
+        content=json.dumps(json_response).encode(),
+    )
+    response.json.return_value = json_response
+    return response
+
+
+def test_get_conditional_headers():
+    assert api.get_conditional_headers({}) == {}
+    cache_entry = {"etag": '"etag"', "last_modified": "last_modified"}
+    assert api.get_conditional_headers(cache_entry) == {
+        "If-None-Match": '"etag"',
+    }
+
+
+def test_get_balance():
+    """The cache gets populated with validators and the payload digest."""
+    card_number = "card_number"
+    session = mock.Mock(spec=requests.sessions.Session)
+    response = make_detail_card_response(12.34, headers={"ETag": '"etag"'})
+    session.post.return_value = response
+    cache = {}
+    balance = api.get_balance(session, card_number, cache)
+    assert balance == 12.34
+    assert session.post.call_args_list == [
+        mock.call(
+            "https://sodexows.mo2o.com/en/v2/card/getDetailCard",
+            json={"cardNumber": card_number},
+            cert=mock.ANY,
+            headers={"Accept": "application/json"},
+            timeout=30,
+        )
+    ]
+    assert cache == {
+        card_number: {
+            "etag": '"etag"',
+            "digest": hashlib.sha256(response.content).hexdigest(),
+            "balance": 12.34,
+        }
+    }
+
+
+@pytest.mark.parametrize("status_code", [304, 412])
+def test_get_balance_not_modified(status_code):
+    """
+    Conditional headers are sent and a 304 or the 412 compliant servers
+    answer to a matching POST serve the cached balance.
+    """
+    card_number = "card_number"
+    session = mock.Mock(spec=requests.sessions.Session)
+    session.post.return_value = mock.Mock(
+        spec=requests.Response, status_code=status_code, content=b""
+    )
+    cache = {card_number: {"etag": '"etag"', "balance": 12.34}}
+    balance = api.get_balance(session, card_number, cache)
+    assert balance == 12.34
+    assert session.post.call_args[1]["headers"] == {
+        "Accept": "application/json",
+        "If-None-Match": '"etag"',
+    }
+    assert session.post.return_value.json.call_count == 0
+
+
+def test_get_balance_unchanged_digest():
+    """Unchanged payloads are not decoded again."""
+    card_number = "card_number"
+    session = mock.Mock(spec=requests.sessions.Session)
+    response = make_detail_card_response(12.34, headers={"ETag": '"new"'})
+    session.post.return_value = response
+    digest = hashlib.sha256(response.content).hexdigest()
+    cache = {
+        card_number: {"etag": '"old"', "digest": digest, "balance": 56.78}
+    }
+    balance = api.get_balance(session, card_number, cache)
+    assert balance == 56.78
+    assert response.json.call_count == 0
+    # the rotated validator is used for the next poll
+    assert cache[card_number]["etag"] == '"new"'
+
+
+def test_get_balance_serve_stale(reset_circuit_breakers):
+    """The cached balance is served when the circuit is open."""
+    card_number = "card_number"
+    session = mock.Mock(spec=requests.sessions.Session)
+    cache = {card_number: {"balance": 12.34}}
+    open_circuit("v2/card/getDetailCard")
+    with pytest.raises(circuit.CircuitOpenError):
+        api.get_balance(session, card_number, cache)
+    assert api.get_balance(session, card_number, cache, True) == 12.34
+    assert session.post.call_count == 0
+
+
 def test_get_clear_pin():
     m_card_number = mock.Mock()
     session = mock.Mock(spec=requests.sessions.Session)
@@ -0,0 +1,187 @@
+from unittest import mock
+
+import pytest
+import requests
+
+from mysodexo import circuit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_circuit_breaker(**kwargs):
+    kwargs.setdefault("minimum_calls", 2)
+    kwargs.setdefault("window_size", 4)
+    kwargs.setdefault("reset_timeout", 10)
+    return circuit.CircuitBreaker("endpoint", clock=Clock(), **kwargs)
+
+
+def fail(circuit_breaker):
+    with pytest.raises(requests.ConnectionError), circuit_breaker.call():
+        raise requests.ConnectionError
+
+
+def succeed(circuit_breaker):
+    with circuit_breaker.call():
+        pass
+
+
+def test_circuit_breaker_closed():
+    """The circuit stays closed below the minimum calls and threshold."""
+    circuit_breaker = make_circuit_breaker()
+    fail(circuit_breaker)
+    assert circuit_breaker.state == circuit.CLOSED
+    succeed(circuit_breaker)
+    succeed(circuit_breaker)
+    assert circuit_breaker.state == circuit.CLOSED
+    assert circuit_breaker.failure_rate == 1 / 3
+
+
+def test_circuit_breaker_open():
+    """The circuit opens on the failure rate and then fails fast."""
+    circuit_breaker = make_circuit_breaker()
+    fail(circuit_breaker)
+    fail(circuit_breaker)
+    assert circuit_breaker.state == circuit.OPEN
+    with pytest.raises(circuit.CircuitOpenError) as ex_info:
+        succeed(circuit_breaker)
+    assert str(ex_info.value) == "circuit endpoint is open"
+
+
+def test_circuit_breaker_other_exceptions():
+    """Exceptions not in `failure_exceptions` mean the upstream answered."""
+    circuit_breaker = make_circuit_breaker()
+    for _ in range(3):
+        with pytest.raises(AssertionError), circuit_breaker.call():
+            raise AssertionError
+    assert circuit_breaker.state == circuit.CLOSED
+    assert circuit_breaker.failure_rate == 0
+
+
+def test_circuit_breaker_half_open_success():
+    """A successful probe closes the circuit and clears the window."""
+    circuit_breaker = make_circuit_breaker()
+    fail(circuit_breaker)
+    fail(circuit_breaker)
+    circuit_breaker.clock.now = 10
+    assert circuit_breaker.state == circuit.HALF_OPEN
+    succeed(circuit_breaker)
+    assert circuit_breaker.state == circuit.CLOSED
+    assert circuit_breaker.failure_rate == 0
+
+
+def test_circuit_breaker_half_open_failure():
+    """A failed probe re-opens the circuit."""
+    circuit_breaker = make_circuit_breaker()
+    fail(circuit_breaker)
+    fail(circuit_breaker)
+    circuit_breaker.clock.now = 10
+    fail(circuit_breaker)
+    assert circuit_breaker.state == circuit.OPEN
+    circuit_breaker.clock.now = 15
+    assert circuit_breaker.state == circuit.OPEN
+
+
+def test_circuit_breaker_half_open_max_calls():
+    """Only `half_open_max_calls` probes are let through at once."""
+    circuit_breaker = make_circuit_breaker()
+    fail(circuit_breaker)
+    fail(circuit_breaker)
+    circuit_breaker.clock.now = 10
+    with circuit_breaker.call():
+        with pytest.raises(circuit.CircuitOpenError):
+            circuit_breaker.before_call()
+    assert circuit_breaker.state == circuit.CLOSED
+
+
+def test_circuit_breaker_half_open_interrupted():
+    """An interrupted probe frees its slot without closing the circuit."""
+    circuit_breaker = make_circuit_breaker()
+    fail(circuit_breaker)
+    fail(circuit_breaker)
+    circuit_breaker.clock.now = 10
+    with pytest.raises(KeyboardInterrupt), circuit_breaker.call():
+        raise KeyboardInterrupt
+    assert circuit_breaker.state == circuit.HALF_OPEN
+    assert circuit_breaker.half_open_calls == 0
+    succeed(circuit_breaker)
+    assert circuit_breaker.state == circuit.CLOSED
+
+
+def test_circuit_breaker_late_outcomes():
+    """Calls let through before a state change don't decide the new state."""
+    circuit_breaker = make_circuit_breaker()
+    closed_token = circuit_breaker.before_call()
+    fail(circuit_breaker)
+    fail(circuit_breaker)
+    assert circuit_breaker.state == circuit.OPEN
+    # a late failure while open doesn't push back the reset
+    circuit_breaker.clock.now = 5
+    circuit_breaker.record_failure(closed_token)
+    assert circuit_breaker.opened_at == 0
+    circuit_breaker.clock.now = 10
+    probe_token = circuit_breaker.before_call()
+    assert probe_token.probe is True
+    # the closed call finishing late isn't taken as the probe outcome
+    circuit_breaker.record_success(closed_token)
+    assert circuit_breaker.state == circuit.HALF_OPEN
+    circuit_breaker.record_failure(probe_token)
+    assert circuit_breaker.state == circuit.OPEN
+    # neither is the probe once the state it decided changed
+    circuit_breaker.record_success(probe_token)
+    assert circuit_breaker.state == circuit.OPEN
+
+
+def test_circuit_breaker_health():
+    circuit_breaker = make_circuit_breaker()
+    succeed(circuit_breaker)
+    fail(circuit_breaker)
+    assert circuit_breaker.health() == {
+        "state": circuit.OPEN,
+        "calls": 2,
+        "failures": 1,
+        "failure_rate": 0.5,
+        "opened_at": 0.0,
+    }
+
+
+def test_get_circuit_breaker(reset_circuit_breakers):
+    circuit_breaker = circuit.get_circuit_breaker("endpoint")
+    assert circuit_breaker.name == "endpoint"
+    assert circuit.get_circuit_breaker("endpoint") is circuit_breaker
+    assert circuit.get_health()["endpoint"] == {
+        "state": circuit.CLOSED,
+        "calls": 0,
+        "failures": 0,
+        "failure_rate": 0.0,
+        "opened_at": None,
+    }
+
+
+def test_get_health_api_endpoints(reset_circuit_breakers):
+    """All the API endpoints are reported before any traffic."""
+    health = circuit.get_health()
+    assert list(health) == [
+        "v3/connect/login",
+        "v3/connect/loginFromSession",
+        "v3/card/getCards",
+        "v2/card/getDetailCard",
+        "v1/card/getClearPin",
+    ]
+    assert {
+        endpoint_health["state"] for endpoint_health in health.values()
+    } == {circuit.CLOSED}
+
+
+def test_configure_circuit_breaker(reset_circuit_breakers):
+    circuit_breaker = circuit.configure_circuit_breaker(
+        "endpoint", minimum_calls=1, reset_timeout=mock.sentinel
+    )
+    assert circuit.get_circuit_breaker("endpoint") is circuit_breaker
+    assert circuit_breaker.minimum_calls == 1
+    assert circuit_breaker.reset_timeout == mock.sentinel
@@ -1,4 +1,5 @@
 import contextlib
+import json
 import pickle
 import tempfile
 from io import StringIO
@@ -85,6 +86,32 @@ def test_cache_session_info():
     assert cached_session_info[1] == dni
 
 
+def test_get_balance_cache_path():
+    with mock.patch(
+        "mysodexo.cli.user_cache_dir", return_value="user_cache_dir"
+    ) as m_user_cache_dir:
+        balance_cache_path = cli.get_balance_cache_path()
+    assert m_user_cache_dir.call_args_list == [mock.call(appname="mysodexo")]
+    assert balance_cache_path == "user_cache_dir/balance.cache"
+
+
+def test_get_cached_balances_file_not_found():
+    """A missing balance cache is an empty one."""
+    with mock.patch("builtins.open", side_effect=FileNotFoundError):
+        assert cli.get_cached_balances() == {}
+
+
+def test_cache_balances():
+    balances = {"card_number": {"digest": "digest", "balance": 12.34}}
+    with tempfile.NamedTemporaryFile() as cache_file:
+        with mock.patch(
+            "mysodexo.cli.get_balance_cache_path", return_value=cache_file.name
+        ):
+            cli.cache_balances(balances)
+            cached_balances = cli.get_cached_balances()
+    assert cached_balances == balances
+
+
 def test_login():
     m_email = mock.Mock()
     m_password = mock.Mock()
@@ -152,8 +179,7 @@ def test_get_session_or_login_login():
 
 
 def test_print_balance():
-    card_details = {"cardBalance": 12.34}
-    cards = [{"pan": "123456******1234", "_details": card_details}]
+    cards = [{"pan": "123456******1234", "_balance": 12.34}]
     with mock.patch("sys.stdout", new_callable=StringIO) as m_stdout:
         cli.print_balance(cards)
     assert m_stdout.getvalue() == "123456******1234: 12.34\n"
@@ -164,20 +190,27 @@ def test_process_balance():
     m_dni = mock.Mock()
     card_number = "0123456789012345"
     cards = [{"pan": "123456******1234", "cardNumber": card_number}]
-    card_details = {"cardBalance": 12.34}
+    balances = {}
     with mock.patch(
         "mysodexo.cli.get_session_or_login", return_value=(m_session, m_dni)
     ) as m_get_session_or_login, mock.patch(
+        "mysodexo.cli.get_cached_balances", return_value=balances
+    ), mock.patch(
+        "mysodexo.cli.cache_balances"
+    ) as m_cache_balances, mock.patch(
         "mysodexo.api.get_cards", return_value=cards
     ) as m_get_cards, mock.patch(
-        "mysodexo.api.get_detail_card", return_value=card_details
-    ) as m_get_detail_card, mock.patch(
+        "mysodexo.api.get_balance", return_value=12.34
+    ) as m_get_balance, mock.patch(
         "sys.stdout", new_callable=StringIO
     ) as m_stdout:
         cli.process_balance()
-    m_get_session_or_login.call_args_list == [mock.call()]
-    m_get_cards.call_args_list == [mock.call(m_session, m_dni)]
-    m_get_detail_card.call_args_list == [mock.call(m_session, card_number)]
+    assert m_get_session_or_login.call_args_list == [mock.call()]
+    assert m_get_cards.call_args_list == [mock.call(m_session, m_dni)]
+    assert m_get_balance.call_args_list == [
+        mock.call(m_session, card_number, balances)
+    ]
+    assert m_cache_balances.call_args_list == [mock.call(balances)]
     assert m_stdout.getvalue() == "123456******1234: 12.34\n"
 
 
@@ -202,3 +235,54 @@ def test_main(
     assert m_process_login.called is process_login_called
     assert m_process_balance.called is process_balance_called
     assert m_print_help.called is print_help_called
+
+
+def test_main_profile():
+    """The `--profile` flag prints the timing summary to stderr."""
+    argv = ["mysodexo/cli.py", "--balance", "--profile"]
+    with patch_sys_argv(
+        argv
+    ), patch_cli_process_balance() as m_process_balance, mock.patch(
+        "sys.stderr", new_callable=StringIO
+    ) as m_stderr:
+        cli.main()
+    assert m_process_balance.call_args_list == [mock.call()]
+    assert m_stderr.getvalue().startswith("span")
+
+
+def test_main_profile_output_speedscope():
+    """The profile gets written to `--profile-output` in the given format."""
+    with tempfile.NamedTemporaryFile() as output:
+        argv = [
+            "mysodexo/cli.py",
+            "--balance",
+            "--profile-output",
+            output.name,
+            "--profile-format",
+            "speedscope",
+        ]
+        with patch_sys_argv(argv), patch_cli_process_balance(), mock.patch(
+            "sys.stderr", new_callable=StringIO
+        ) as m_stderr:
+            cli.main()
+        with open(output.name) as f:
+            speedscope = json.load(f)
+    assert m_stderr.getvalue().startswith("span")
+    assert speedscope["$schema"] == (
+        "https://www.speedscope.app/file-format-schema.json"
+    )
+
+
+def test_main_profile_format_without_output():
+    """The `--profile-format` is rejected without `--profile-output`."""
+    argv = ["mysodexo/cli.py", "--balance", "--profile-format", "speedscope"]
+    with patch_sys_argv(
+        argv
+    ), patch_cli_process_balance() as m_process_balance, mock.patch(
+        "sys.stderr", new_callable=StringIO
+    ) as m_stderr, pytest.raises(
+        SystemExit
+    ):
+        cli.main()
+    assert m_process_balance.call_count == 0
+    assert "--profile-format requires --profile-output" in m_stderr.getvalue()
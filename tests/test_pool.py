@@ -0,0 +1,231 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+from mysodexo import pool
+
+
+def make_login_session():
+    session = requests.session()
+    session.cookies.set("PHPSESSID", "session1")
+    return session
+
+
+def patch_api_login(account_info=None):
+    return mock.patch(
+        "mysodexo.api.login",
+        side_effect=lambda email, password: (
+            make_login_session(),
+            account_info or {"dni": "dni"},
+        ),
+    )
+
+
+def make_account_session_pool(**kwargs):
+    return pool.AccountSessionPool("foo@bar.com", "password", **kwargs)
+
+
+def test_acquire_logins_once():
+    """Only the first session logs in, the next ones share its cookies."""
+    account = make_account_session_pool()
+    with patch_api_login() as m_login:
+        session1 = account.acquire()
+        session2 = account.acquire()
+    assert m_login.call_args_list == [mock.call("foo@bar.com", "password")]
+    assert account.account_info == {"dni": "dni"}
+    assert session1 is not session2
+    assert session2.cookies.get_dict() == {"PHPSESSID": "session1"}
+    assert account.stats()["in_use"] == 2
+
+
+def test_acquire_reuses_idle():
+    account = make_account_session_pool()
+    with patch_api_login():
+        with account.session() as session1:
+            pass
+        with account.session() as session2:
+            pass
+    assert session1 is session2
+    stats = account.stats()
+    assert stats["size"] == 1
+    assert stats["idle"] == 1
+    assert stats["in_use"] == 0
+    assert stats["acquisitions"] == 2
+
+
+def test_acquire_login_error():
+    """A failed login doesn't leak a pool slot."""
+    account = make_account_session_pool(max_sessions=1)
+    with mock.patch(
+        "mysodexo.api.login", side_effect=AssertionError
+    ), pytest.raises(AssertionError):
+        account.acquire()
+    assert account.stats()["size"] == 0
+    assert account.stats()["in_use"] == 0
+
+
+def test_acquire_timeout():
+    account = make_account_session_pool(max_sessions=1)
+    with patch_api_login(), account.session():
+        with pytest.raises(pool.PoolTimeoutError):
+            account.acquire(timeout=0.01)
+
+
+def test_acquire_waits_for_release():
+    """Threads wait for a session once `max_sessions` are in use."""
+    account = make_account_session_pool(max_sessions=1)
+    acquired = []
+    with patch_api_login():
+        session = account.acquire()
+        thread = threading.Thread(
+            target=lambda: acquired.append(account.acquire())
+        )
+        thread.start()
+        while account.stats()["waiting"] == 0:
+            time.sleep(0.001)
+        assert acquired == []
+        account.release(session)
+        thread.join()
+    assert acquired == [session]
+    stats = account.stats()
+    assert stats["waiting"] == 0
+    assert stats["utilization"] == 1
+    assert stats["max_wait"] > 0
+    assert stats["average_wait"] == stats["total_wait"] / 2
+
+
+def test_cookies_shared_on_release():
+    """Cookies received by a session get synced to the other sessions."""
+    account = make_account_session_pool()
+    with patch_api_login():
+        session1 = account.acquire()
+        session2 = account.acquire()
+    account.release(session2)
+    session1.cookies.set("PHPSESSID", "session2")
+    account.release(session1)
+    assert account.cookies_version == 1
+    session = account.acquire()
+    assert session is session1
+    session = account.acquire()
+    assert session is session2
+    assert session2.cookies.get_dict() == {"PHPSESSID": "session2"}
+
+
+def test_stale_session_released_after_refresh():
+    """A session still holding the old cookies can't revert a refresh."""
+    account = make_account_session_pool()
+    with patch_api_login():
+        session1 = account.acquire()
+        session2 = account.acquire()
+
+    def login_from_session(session):
+        session.cookies.set("PHPSESSID", "refreshed")
+        return {"dni": "dni"}
+
+    with mock.patch(
+        "mysodexo.api.login_from_session", side_effect=login_from_session
+    ):
+        account.refresh(session1)
+    account.release(session1)
+    account.release(session2)
+    assert account.cookies.get_dict() == {"PHPSESSID": "refreshed"}
+    assert account.cookies_version == 1
+    session = account.acquire()
+    assert session is session2
+    assert session2.cookies.get_dict() == {"PHPSESSID": "refreshed"}
+
+
+def test_stale_session_merges_own_changes():
+    """Cookies an outdated session received are still shared."""
+    account = make_account_session_pool()
+    with patch_api_login():
+        session1 = account.acquire()
+        session2 = account.acquire()
+    session1.cookies.set("PHPSESSID", "refreshed")
+    account.release(session1)
+    session2.cookies.set("other", "value")
+    account.release(session2)
+    assert account.cookies.get_dict() == {
+        "PHPSESSID": "refreshed",
+        "other": "value",
+    }
+    assert account.cookies_version == 2
+    # session2 gets synced with the refresh it missed on its next acquire
+    assert account.acquire() is session2
+    assert session2.cookies.get_dict() == {
+        "PHPSESSID": "refreshed",
+        "other": "value",
+    }
+
+
+def test_refresh():
+    account = make_account_session_pool()
+    with patch_api_login():
+        session = account.acquire()
+
+    def login_from_session(session):
+        session.cookies.set("PHPSESSID", "refreshed")
+        return {"dni": "refreshed"}
+
+    with mock.patch(
+        "mysodexo.api.login_from_session", side_effect=login_from_session
+    ):
+        account_info = account.refresh(session)
+    assert account_info == {"dni": "refreshed"}
+    assert account.account_info == account_info
+    assert account.cookies.get_dict() == {"PHPSESSID": "refreshed"}
+    assert account.cookies_version == 1
+
+
+def test_max_connections():
+    account = make_account_session_pool(max_connections=2)
+    with patch_api_login(), account.session() as session:
+        adapter = session.get_adapter("https://sodexows.mo2o.com/en/")
+    assert adapter._pool_maxsize == 2
+    assert adapter._pool_block is True
+
+
+def test_session_pool():
+    session_pool = pool.SessionPool(max_sessions=2)
+    with patch_api_login() as m_login:
+        with session_pool.session("foo@bar.com", "password"):
+            pass
+        with session_pool.session("bar@foo.com", "password"):
+            pass
+        with session_pool.session("foo@bar.com", "password"):
+            pass
+    assert m_login.call_count == 2
+    stats = session_pool.stats()
+    assert list(stats) == ["foo@bar.com", "bar@foo.com"]
+    assert stats["foo@bar.com"]["acquisitions"] == 2
+    assert stats["foo@bar.com"]["max_sessions"] == 2
+
+
+def test_session_pool_wrong_password():
+    """An account sessions can't be borrowed with a wrong password."""
+    session_pool = pool.SessionPool()
+    with patch_api_login() as m_login:
+        with session_pool.session("foo@bar.com", "password"):
+            pass
+        with pytest.raises(pool.InvalidCredentialsError):
+            with session_pool.session("foo@bar.com", "WRONG"):
+                pass
+    assert m_login.call_count == 1
+    assert session_pool.stats()["foo@bar.com"]["acquisitions"] == 1
+
+
+def test_session_pool_password_before_login():
+    """A failed first login doesn't lock the account on a wrong password."""
+    session_pool = pool.SessionPool()
+    with mock.patch(
+        "mysodexo.api.login", side_effect=AssertionError
+    ), pytest.raises(AssertionError):
+        with session_pool.session("foo@bar.com", "WRONG"):
+            pass
+    with patch_api_login() as m_login:
+        with session_pool.session("foo@bar.com", "password"):
+            pass
+    assert m_login.call_args_list == [mock.call("foo@bar.com", "password")]
@@ -0,0 +1,132 @@
+import json
+import pstats
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import pytest
+from urllib3.connection import HTTPSConnection
+
+from mysodexo import profiling
+
+
+def test_span_not_profiling():
+    """Spans are no-op outside of a `profile()` block."""
+    with profiling.span("span"):
+        pass
+    assert profiling._active_profiler is None
+
+
+def test_profile():
+    with profiling.profile() as profiler:
+        with profiling.span("outer"):
+            with profiling.span("inner"):
+                pass
+            with profiling.span("inner"):
+                pass
+    assert profiling._active_profiler is None
+    assert profiler.cprofile is None
+    (events,) = profiler.events.values()
+    assert [(kind, name) for kind, name, _ in events] == [
+        ("O", "outer"),
+        ("O", "inner"),
+        ("C", "inner"),
+        ("O", "inner"),
+        ("C", "inner"),
+        ("C", "outer"),
+    ]
+    totals = profiler.totals()
+    assert list(totals) == ["inner", "outer"]
+    assert totals["inner"][0] == 2
+    assert totals["outer"][0] == 1
+    assert totals["outer"][1] >= totals["inner"][1]
+    summary = profiler.summary().splitlines()
+    assert summary[0].split() == ["span", "calls", "total", "(ms)"]
+    assert summary[1].split()[:2] == ["inner", "2"]
+    assert summary[2].split()[:2] == ["outer", "1"]
+    assert summary[3].split()[0] == "total"
+
+
+def test_profile_threads():
+    """Overlapping spans from different threads are timed separately."""
+    opened = threading.Event()
+    closed = threading.Event()
+
+    def target():
+        with profiling.span("thread"):
+            opened.set()
+            closed.wait()
+
+    with profiling.profile() as profiler:
+        thread = threading.Thread(target=target)
+        with profiling.span("main"):
+            thread.start()
+            opened.wait()
+            time.sleep(0.02)
+        closed.set()
+        thread.join()
+    # each thread only sees its own spans even though they overlapped
+    assert sorted(
+        [(kind, name) for kind, name, _ in events]
+        for events in profiler.events.values()
+    ) == [
+        [("O", "main"), ("C", "main")],
+        [("O", "thread"), ("C", "thread")],
+    ]
+    totals = profiler.totals()
+    assert totals["main"][0] == totals["thread"][0] == 1
+    assert totals["main"][1] >= 0.02
+    assert totals["thread"][1] >= 0.02
+    speedscope = profiler.to_speedscope()
+    assert len(speedscope["profiles"]) == 2
+
+
+def test_profile_connections():
+    """New connections are timed in their own span nested in the request."""
+    with mock.patch.object(HTTPSConnection, "connect") as m_connect:
+        with profiling.profile() as profiler:
+            with profiling.span("http endpoint"):
+                HTTPSConnection("sodexows.mo2o.com").connect()
+        assert HTTPSConnection.connect is m_connect
+    assert m_connect.call_count == 1
+    (events,) = profiler.events.values()
+    assert [(kind, name) for kind, name, _ in events] == [
+        ("O", "http endpoint"),
+        ("O", "tls connect"),
+        ("C", "tls connect"),
+        ("C", "http endpoint"),
+    ]
+
+
+def test_profile_nested():
+    """Nested profiling is not supported."""
+    with profiling.profile(), pytest.raises(RuntimeError):
+        with profiling.profile():
+            pass
+
+
+def test_profile_pstats_output():
+    with tempfile.NamedTemporaryFile() as output:
+        with profiling.profile(output.name) as profiler:
+            with profiling.span("span"):
+                pass
+        stats = pstats.Stats(output.name)
+    assert profiler.cprofile is not None
+    assert stats.total_calls > 0
+
+
+def test_profile_speedscope_output():
+    with tempfile.NamedTemporaryFile() as output:
+        with profiling.profile(output.name, profiling.SPEEDSCOPE_FORMAT):
+            with profiling.span("span"):
+                pass
+        with open(output.name) as f:
+            speedscope = json.load(f)
+    assert speedscope["shared"] == {"frames": [{"name": "span"}]}
+    (profile,) = speedscope["profiles"]
+    assert profile["type"] == "evented"
+    assert [(e["type"], e["frame"]) for e in profile["events"]] == [
+        ("O", 0),
+        ("C", 0),
+    ]